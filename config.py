@@ -6,12 +6,62 @@ load_dotenv()
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Stream the model's reply and start each tool call as soon as its arguments are complete.
+# Off by default since streamed tool calls run one by one instead of sharing a pipeline.
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() == "true"
+# Seconds between status checks while waiting on a Batch API job
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+
+# Conversation History Configuration
+# At most HISTORY_MAX_TURNS user turns are sent verbatim. When the window is full the
+# oldest turns are rolled into a summary and the newest half of the window is kept.
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+if HISTORY_MAX_TURNS < 1:
+    raise ValueError("HISTORY_MAX_TURNS must be at least 1")
+# The summary and window are snapshotted here after every turn and restored on
+# startup. Set to an empty string to keep the conversation in memory only. Every agent
+# uses this file unless it is given its own, so concurrent agents should not share it.
+HISTORY_FILE = os.getenv("HISTORY_FILE", "conversation.mpk.zst")
 
 # Database Configuration
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
     "port": os.getenv("DB_PORT", "5432"),
-    "database": os.getenv("DB_NAME"),
+    "dbname": os.getenv("DB_NAME"),
     "user": os.getenv("DB_USER"),
     "password": os.getenv("DB_PASSWORD")
-} 
\ No newline at end of file
+} 
+
+# Connection Pool Configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Prepared Statement Configuration
+# Queries are prepared server-side once they have been executed this many times on
+# a connection. Set to "none" when connecting through PgBouncer in transaction mode.
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "1")
+DB_PREPARE_THRESHOLD = None if _prepare_threshold.lower() == "none" else int(_prepare_threshold)
+DB_PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", "500"))
+
+# Query Guard Configuration
+# SELECTs without a LIMIT return at most DB_QUERY_ROW_LIMIT rows, marked as truncated when
+# there were more, and every statement is cancelled by the server after
+# DB_STATEMENT_TIMEOUT. Set the timeout to an empty string to disable it. It is sent as
+# a startup parameter, which PgBouncer rejects by default, so PgBouncer setups must
+# disable it as well as setting DB_PREPARE_THRESHOLD to "none".
+DB_QUERY_ROW_LIMIT = int(os.getenv("DB_QUERY_ROW_LIMIT", "1000"))
+DB_STATEMENT_TIMEOUT = os.getenv("DB_STATEMENT_TIMEOUT", "10s")
+
+# Result Streaming Configuration
+# Read queries are fetched DB_FETCH_SIZE rows at a time from a server-side cursor and
+# the JSON handed to the model is cut off at whole rows to stay within DB_RESULT_MAX_BYTES.
+DB_FETCH_SIZE = int(os.getenv("DB_FETCH_SIZE", "1000"))
+DB_RESULT_MAX_BYTES = int(os.getenv("DB_RESULT_MAX_BYTES", "65536"))
+
+# Query Result Cache Configuration
+# Results of read queries are reused for up to QUERY_CACHE_TTL seconds. Any other
+# statement run by the agent, including reads that call volatile or unknown
+# functions such as nextval(), clears the cache.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "128"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
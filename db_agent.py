@@ -1,126 +1,584 @@
-import psycopg2
-from openai import OpenAI
-from config import OPENAI_API_KEY, DB_CONFIG
-import json
-from typing import List, Dict
-from datetime import datetime, date, time
-from decimal import Decimal
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg.types.numeric import FloatLoader
+from psycopg.types.string import TextLoader
+from psycopg_pool import AsyncConnectionPool
+from openai import AsyncOpenAI, APIConnectionError, DefaultAsyncHttpxClient, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from config import (
+    OPENAI_API_KEY, LLM_MAX_CONCURRENCY, LLM_STREAMING, BATCH_POLL_INTERVAL, HISTORY_MAX_TURNS, HISTORY_FILE, DB_CONFIG, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+    DB_PREPARE_THRESHOLD, DB_PREPARED_MAX, DB_QUERY_ROW_LIMIT, DB_STATEMENT_TIMEOUT,
+    DB_FETCH_SIZE, DB_RESULT_MAX_BYTES,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+)
+from cachetools import TTLCache
+from sqlglot import exp
+import asyncio
+import fastjsonschema
+import httpx
+import logging
+import msgpack
+import orjson
+import os
+import re
+import sqlglot
+import zstandard as zstd
+from typing import List, Dict, NamedTuple, Optional
+from uuid import uuid4
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None
+
+# sqlglot logs a warning for every statement it only partially understands
+logging.getLogger("sqlglot").setLevel(logging.ERROR)
+
+# JSON schema of the execute_query tool arguments, also used to validate them
+EXECUTE_QUERY_PARAMETERS = {
+    "type": "object",
+    "properties": {
+        "query": {
+            "type": "string",
+            "description": "The SQL query to execute."
+        }
+    },
+    "required": ["query"]
+}
+validate_execute_query = fastjsonschema.compile(EXECUTE_QUERY_PARAMETERS)
+
+# Encoders for the values orjson can't serialize itself, looked up by exact type.
+# The connection's loaders already return numerics as floats and intervals as text
+JSON_ENCODERS = {
+    bytes: lambda value: "\\x" + value.hex()
+}
+
+def encode_json_default(value):
+    """Convert a value orjson can't serialize into a JSON-compatible one"""
+    return JSON_ENCODERS.get(type(value), str)(value)
+
+_client: Optional[AsyncOpenAI] = None
+
+def get_client():
+    """Return the OpenAI client shared by all agents in the process"""
+    global _client
+    if _client is None:
+        # One keep-alive HTTP/2 pool lets concurrent requests share a connection
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            # create_completion retries failed requests itself, outside the semaphore
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        )
+    return _client
+
+class UnsafeQueryError(Exception):
+    """Raised for queries refused before they are sent to the database"""
+
+class GuardedQuery(NamedTuple):
+    """A query as rewritten by DatabaseAgent.guard_query"""
+    query: str
+    # Whether it is a single read that can be declared as a server-side cursor
+    streamable: bool
+    # Whether it is a read whose result can be reused from the cache
+    cacheable: bool = False
+    # The LIMIT the guard added, if any. The query asks for one row more so a
+    # result cut short by it can be marked as truncated
+    row_limit: Optional[int] = None
 
 class DatabaseAgent:
-    def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.db_connection = None
-        self.connect_to_db()
+    SYSTEM_PROMPT = "You are a helpful database assistant. You can execute SQL queries to explore and analyze the database. Remember previous interactions and use that context to provide more relevant responses."
+    SUMMARY_PROMPT = "Summarize this conversation between a user and a database assistant in a few short paragraphs. Keep table and column names, important query results, and the user's goals and preferences. If an earlier summary is given, fold it into the new one."
+    # Longest excerpt of a single message included when summarizing
+    SUMMARY_MESSAGE_CHARS = 2000
+    # Prompts that ask for a plain lookup get small tool results back without a
+    # second model call
+    DIRECT_ANSWER_PATTERN = re.compile(r"^(show|list|select|count|describe)\b", re.IGNORECASE)
+    DIRECT_ANSWER_MAX_CHARS = 512
+    # Postgres types returned as their text representation instead of Python objects
+    TEXT_TYPES = ("date", "time", "timetz", "timestamp", "timestamptz", "interval")
+    # Functions whose results can change between calls or that may write, such as
+    # nextval(). Unknown functions parse as Anonymous and are treated the same way
+    VOLATILE_FUNCTIONS = (
+        exp.Anonymous, exp.AnonymousAggFunc, exp.Rand, exp.Uuid,
+        exp.CurrentDate, exp.CurrentTime, exp.CurrentTimestamp
+    )
+
+    def __init__(self, client=None, history_file=HISTORY_FILE):
+        # create_completion retries failed requests itself, so a client passed in
+        # must not retry as well. The copy shares the original's connection pool
+        self.client = client.with_options(max_retries=0) if client else get_client()
+        self.pool = AsyncConnectionPool(
+            conninfo=make_conninfo(**DB_CONFIG),
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            kwargs=self.connection_kwargs(),
+            configure=self.configure_connection,
+            open=False
+        )
+        # Cap in-flight requests to stay under the account's rate limits
+        self._llm_sem = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._db_sem = asyncio.Semaphore(DB_POOL_MAX_SIZE)
+        # Results of recent read queries, keyed by the SQL text
+        self._qcache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        # Routes this session's requests to the same prompt cache on OpenAI's side
+        self._session_id = uuid4().hex
         self.conversation_history: List[Dict] = [
-            {"role": "system", "content": "You are a helpful database assistant. You can execute SQL queries to explore and analyze the database. Remember previous interactions and use that context to provide more relevant responses."}
+            {"role": "system", "content": self.SYSTEM_PROMPT}
         ]
+        # Older turns are rolled into this summary once the history outgrows its window
+        self.max_turns = HISTORY_MAX_TURNS
+        self.summary: Optional[str] = None
+        # Agents sharing a history file overwrite each other's snapshots, so give
+        # each agent in a process or directory its own
+        self.history_file = history_file
+        self.load_history()
         self.tools = [
             {
                 "type": "function",
                 "function": {
                     "name": "execute_query",
                     "description": "Execute a SQL query on the PostgreSQL database",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The SQL query to execute."
-                            }
-                        },
-                        "required": ["query"]
-                    }
+                    "parameters": EXECUTE_QUERY_PARAMETERS
                 }
             }
         ]
 
-    def connect_to_db(self):
-        """Establish connection to the PostgreSQL database"""
+    async def connect_to_db(self):
+        """Open the connection pool to the PostgreSQL database"""
         try:
-            self.db_connection = psycopg2.connect(**DB_CONFIG)
+            await self.pool.open(wait=True)
             print("Successfully connected to the database")
         except Exception as e:
             print(f"Error connecting to the database: {e}")
             raise
 
-    def serialize_value(self, value):
-        """Serialize different types of values to JSON-compatible format"""
-        if isinstance(value, (datetime, date)):
-            return value.isoformat()
-        elif isinstance(value, time):
-            return value.strftime('%H:%M:%S')
-        elif isinstance(value, Decimal):
-            return float(value)
-        elif isinstance(value, (list, tuple)):
-            return [self.serialize_value(item) for item in value]
-        elif isinstance(value, dict):
-            return {k: self.serialize_value(v) for k, v in value.items()}
-        return value
-
-    def execute_query(self, query):
-        """Execute a SQL query and return the results"""
+    def connection_kwargs(self):
+        """Build the connection parameters used for every pooled connection"""
+        kwargs = {"prepare_threshold": DB_PREPARE_THRESHOLD}
+        if DB_STATEMENT_TIMEOUT:
+            # Set at connection startup so it costs no extra round-trip per query
+            kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+        return kwargs
+
+    async def configure_connection(self, conn):
+        """Set up a new pooled connection before it is first used"""
+        # Keep up to DB_PREPARED_MAX prepared statements per connection, evicting
+        # and deallocating the least recently used ones
+        conn.prepared_max = DB_PREPARED_MAX
+        # Load values straight into JSON-compatible types: dates and times as
+        # text and numerics as floats, including inside arrays. Results stay in
+        # text format since binary has no loader for enums, citext, hstore, money
+        # and most extension types, aclitem has no binary form and infinite dates
+        # fail to load
+        for type_name in self.TEXT_TYPES:
+            conn.adapters.register_loader(type_name, TextLoader)
+        conn.adapters.register_loader("numeric", FloatLoader)
+
+    def is_streamable(self, statements):
+        """Check whether parsed statements are a single read that can be declared as a server-side cursor"""
+        if len(statements) != 1:
+            return False
+        statement = statements[0]
+        # DECLARE rejects SELECT ... INTO and data-modifying statements inside WITH
+        return (
+            isinstance(statement, (exp.Query, exp.Values))
+            and not statement.args.get("into")
+            and not statement.find(exp.Insert, exp.Update, exp.Delete, exp.Merge)
+        )
+
+    async def dump_results(self, cursor, row_limit=None):
+        """Stream rows from a cursor into a JSON document, truncating large results
+
+        Rows past row_limit are dropped and mark the result as truncated.
+        """
+        columns = [desc[0] for desc in cursor.description]
+        buf = bytearray(b'{"columns":')
+        buf += orjson.dumps(columns)
+        buf += b',"results":['
+        # Leave room for the closing bytes so the whole document stays under the cap
+        max_bytes = DB_RESULT_MAX_BYTES - len(b'],"truncated":true}')
+        truncated = False
+        first = True
+        count = 0
+        while not truncated and (rows := await cursor.fetchmany(DB_FETCH_SIZE)):
+            if row_limit is not None and count + len(rows) > row_limit:
+                rows = rows[:row_limit - count]
+                truncated = True
+                if not rows:
+                    break
+            count += len(rows)
+            # Values are mostly JSON-compatible already, the rest go through JSON_ENCODERS
+            chunk = orjson.dumps(rows, default=encode_json_default)
+            if len(buf) + len(chunk) <= max_bytes:
+                # The whole batch fits, so splice it in without its brackets
+                if not first:
+                    buf += b","
+                first = False
+                buf += memoryview(chunk)[1:-1]
+                continue
+            # Close to the limit rows are added one at a time while they fit. A row
+            # that is too large on its own is left out and only marks the truncation
+            for row in rows:
+                encoded = orjson.dumps(row, default=encode_json_default)
+                if len(buf) + len(encoded) + 1 > max_bytes:
+                    truncated = True
+                    break
+                if not first:
+                    buf += b","
+                first = False
+                buf += encoded
+        buf += b"]"
+        if truncated:
+            buf += b',"truncated":true'
+        buf += b"}"
+        return buf.decode()
+
+    def guard_query(self, query):
+        """Refuse obviously destructive statements and add a LIMIT to unbounded SELECTs
+
+        Returns a GuardedQuery with the query to run.
+        """
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute(query)
-            if cursor.description:  # If the query returns data
-                columns = [desc[0] for desc in cursor.description]
-                results = cursor.fetchall()
-                # Serialize each row of results
-                serialized_results = [
-                    [self.serialize_value(value) for value in row]
-                    for row in results
-                ]
-                cursor.close()
-                return json.dumps({
-                    "columns": columns,
-                    "results": serialized_results
-                })
-            else:  # If the query doesn't return data (e.g., INSERT, UPDATE)
-                self.db_connection.commit()
-                cursor.close()
-                return json.dumps({"message": "Query executed successfully"})
+            statements = [statement for statement in sqlglot.parse(query, read="postgres") if statement]
+        except sqlglot.errors.SqlglotError:
+            # Leave anything sqlglot can't parse for Postgres to judge
+            return GuardedQuery(query, False)
+        for statement in statements:
+            for change in statement.find_all(exp.Delete, exp.Update):
+                if not change.args.get("where"):
+                    raise UnsafeQueryError(f"Refusing to run {change.key.upper()} without a WHERE clause")
+        streamable = self.is_streamable(statements)
+        cacheable = streamable and not statements[0].find(*self.VOLATILE_FUNCTIONS)
+        if len(statements) == 1:
+            statement = statements[0]
+            # SELECT ... INTO creates a table, so limiting it would change what is stored
+            if isinstance(statement, exp.Query) and not any(
+                statement.args.get(arg) for arg in ("limit", "fetch", "into")
+            ):
+                # One row past the limit shows whether the result was cut short
+                statement = statement.limit(DB_QUERY_ROW_LIMIT + 1, copy=False)
+                return GuardedQuery(
+                    statement.sql(dialect="postgres"), streamable, cacheable, row_limit=DB_QUERY_ROW_LIMIT
+                )
+        return GuardedQuery(query, streamable, cacheable)
+
+    async def execute_query(self, query):
+        """Execute a SQL query, answering repeated reads from the result cache"""
+        try:
+            guarded = self.guard_query(query)
+        except UnsafeQueryError as e:
+            return orjson.dumps({"error": str(e)}).decode()
+        if not guarded.cacheable:
+            # Writes, schema changes and volatile functions can change what cached
+            # reads return
+            self._qcache.clear()
+            return await self.run_query(guarded)
+        result = self._qcache.get(guarded.query)
+        if result is None:
+            result = await self.run_query(guarded)
+            if not result.startswith('{"error"'):
+                self._qcache[guarded.query] = result
+        return result
+
+    async def run_query(self, guarded):
+        """Execute a guarded SQL query on a pooled connection and return the results"""
+        try:
+            # The pool commits on success and rolls back on error
+            async with self._db_sem, self.pool.connection() as conn:
+                if guarded.streamable:
+                    # Fetch rows in batches instead of materializing the whole result
+                    cursor = conn.cursor(name=f"agent_{uuid4().hex}")
+                else:
+                    cursor = conn.cursor()
+                async with cursor:
+                    await cursor.execute(guarded.query)
+                    if cursor.description:  # If the query returns data
+                        return await self.dump_results(cursor, guarded.row_limit)
+                    else:  # If the query doesn't return data (e.g., INSERT, UPDATE)
+                        return orjson.dumps({"message": "Query executed successfully"}).decode()
         except Exception as e:
             print(f"Error executing query: {e}")
-            self.db_connection.rollback()
-            return json.dumps({"error": str(e)})
+            return orjson.dumps({"error": str(e)}).decode()
 
-    def get_ai_response(self, prompt):
+    async def execute_queries(self, queries):
+        """Execute SQL queries, pipelining them in a single round-trip when they are all reads"""
+        guarded = []
+        results = []
+        for query in queries:
+            try:
+                checked = self.guard_query(query)
+            except UnsafeQueryError as e:
+                guarded.append(GuardedQuery(query, False))
+                results.append(orjson.dumps({"error": str(e)}).decode())
+                continue
+            if not checked.cacheable:
+                # Any query that may write runs the turn's queries separately so the
+                # cache is cleared
+                return await asyncio.gather(*[self.execute_query(query) for query in queries])
+            guarded.append(checked)
+            # Cached results are reused, only the rest go through the pipeline
+            results.append(self._qcache.get(checked.query))
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        try:
+            async with self._db_sem, self.pool.connection() as conn:
+                # Server-side cursors can't be used in pipeline mode
+                cursors = {i: conn.cursor() for i in pending}
+                try:
+                    async with conn.pipeline():
+                        for i, cursor in cursors.items():
+                            await cursor.execute(guarded[i].query)
+                except psycopg.Error as e:
+                    # Results stop at the failing query, the rest were skipped
+                    print(f"Error executing query: {e}")
+                    failed = next((i for i, cursor in cursors.items() if cursor.pgresult is None), None)
+                    if failed is not None:
+                        results[failed] = orjson.dumps({"error": str(e)}).decode()
+                    await conn.rollback()
+                for i, cursor in cursors.items():
+                    if cursor.pgresult is not None:
+                        results[i] = await self.dump_results(cursor, guarded[i].row_limit)
+                        self._qcache[guarded[i].query] = results[i]
+                    await cursor.close()
+        except Exception as e:
+            print(f"Error executing pipelined queries: {e}")
+        # Run anything the pipeline didn't get to on its own
+        skipped = [i for i, result in enumerate(results) if result is None]
+        reruns = await asyncio.gather(*[self.execute_query(queries[i]) for i in skipped])
+        for i, result in zip(skipped, reruns):
+            results[i] = result
+        return results
+
+    @retry(
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(5),
+        reraise=True
+    )
+    async def create_completion(self, **kwargs):
+        """Call the chat completions API, backing off on rate limit and transient errors"""
+        async with self._llm_sem:
+            return await self.client.chat.completions.create(prompt_cache_key=self._session_id, **kwargs)
+
+    def parse_query(self, tool_call):
+        """Parse and validate the arguments of an execute_query tool call"""
+        function_args = orjson.loads(tool_call["function"]["arguments"])
+        validate_execute_query(function_args)
+        return function_args["query"]
+
+    async def run_tool_calls(self, tool_calls):
+        """Execute the tool calls of a model message and return their results in order"""
+        if len(tool_calls) > 1 and all(tool_call["function"]["name"] == "execute_query" for tool_call in tool_calls):
+            try:
+                queries = [self.parse_query(tool_call) for tool_call in tool_calls]
+            except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaException):
+                # Let each call report its own argument errors
+                queries = None
+            if queries:
+                # Read-only queries from the same turn share one round-trip
+                return await self.execute_queries(queries)
+        return await asyncio.gather(*[self.run_tool_call(tool_call) for tool_call in tool_calls])
+
+    async def run_tool_call(self, tool_call):
+        """Execute a single tool call and return its result"""
+        function_name = tool_call["function"]["name"]
+        if function_name == "execute_query":
+            try:
+                query = self.parse_query(tool_call)
+            except (orjson.JSONDecodeError, fastjsonschema.JsonSchemaException) as e:
+                return orjson.dumps({"error": f"Invalid arguments for {function_name}: {e}"}).decode()
+            return await self.execute_query(query)
+        return orjson.dumps({"error": f"Unknown function: {function_name}"}).decode()
+
+    def load_history(self):
+        """Restore the summary and conversation window saved by a previous session"""
+        if not self.history_file or not os.path.exists(self.history_file):
+            return
+        try:
+            with open(self.history_file, "rb") as f:
+                state = msgpack.unpackb(zstd.ZstdDecompressor().decompress(f.read()))
+            summary, history = state["summary"], list(state["history"])
+        except Exception as e:
+            print(f"Error loading conversation history: {e}")
+            return
+        self.summary = summary
+        self.conversation_history = self.conversation_history[:1] + history
+        if history:
+            print("Restored conversation history from the previous session")
+
+    def save_history(self):
+        """Snapshot the summary and conversation window to disk"""
+        if not self.history_file:
+            return
+        # The system prompt is not saved so changes to it apply to resumed sessions
+        state = {"summary": self.summary, "history": self.conversation_history[1:]}
+        data = zstd.ZstdCompressor(level=3).compress(msgpack.packb(state, use_bin_type=True))
+        try:
+            # Write to a temporary file first so a crash never leaves a partial snapshot
+            tmp_file = f"{self.history_file}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(data)
+            os.replace(tmp_file, self.history_file)
+        except OSError as e:
+            print(f"Error saving conversation history: {e}")
+
+    def to_history_message(self, message):
+        """Convert an API response message into a plain history entry"""
+        entry = {"role": message.role, "content": message.content}
+        if message.tool_calls:
+            entry["tool_calls"] = [
+                {
+                    "id": tool_call.id,
+                    "type": "function",
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments
+                    }
+                }
+                for tool_call in message.tool_calls
+            ]
+        return entry
+
+    def build_messages(self):
+        """Build the messages sent to the model: system prompt, summary, then the window"""
+        messages = self.conversation_history[:1]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        return messages + self.conversation_history[1:]
+
+    async def summarize(self, messages):
+        """Summarize messages, folding in the previous summary"""
+        lines = []
+        for message in messages:
+            if message.get("content"):
+                lines.append(f"{message['role']}: {message['content'][:self.SUMMARY_MESSAGE_CHARS]}")
+            for tool_call in message.get("tool_calls", []):
+                lines.append(f"{message['role']} called {tool_call['function']['name']}: {tool_call['function']['arguments']}")
+        transcript = "\n".join(lines)
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n\n{transcript}"
+        response = await self.create_completion(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": self.SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ]
+        )
+        return response.choices[0].message.content
+
+    async def compact_history(self):
+        """Roll the oldest turns into the summary once the history outgrows its window"""
+        turn_starts = [i for i, message in enumerate(self.conversation_history) if message["role"] == "user"]
+        if len(turn_starts) < self.max_turns:
+            return
+        # Keep the newest half of the window so the summary is regenerated every few
+        # turns. Rounding down leaves room for the turn about to be added
+        keep = self.max_turns // 2
+        cut = turn_starts[-keep] if keep else len(self.conversation_history)
+        try:
+            self.summary = await self.summarize(self.conversation_history[1:cut])
+        except Exception as e:
+            print(f"Error summarizing conversation history: {e}")
+            return
+        self.conversation_history = self.conversation_history[:1] + self.conversation_history[cut:]
+
+    def can_answer_directly(self, prompt, tool_responses):
+        """Check whether tool results can be returned to the user as they are"""
+        if not self.DIRECT_ANSWER_PATTERN.match(prompt):
+            return False
+        if any(tr["content"].startswith('{"error"') for tr in tool_responses):
+            # Let the model explain errors
+            return False
+        return sum(len(tr["content"]) for tr in tool_responses) < self.DIRECT_ANSWER_MAX_CHARS
+
+    async def stream_response(self, **kwargs):
+        """Stream a chat completion, starting each tool call once its arguments are complete
+
+        Returns the assistant message as a history entry along with the results of its
+        tool calls.
+        """
+        content = []
+        tool_calls = {}
+        tasks = {}
+
+        def start_tool_calls():
+            for index, tool_call in tool_calls.items():
+                if index not in tasks:
+                    tasks[index] = asyncio.create_task(self.run_tool_call(tool_call))
+
+        try:
+            stream = await self.create_completion(stream=True, **kwargs)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content.append(delta.content)
+                for tool_call in delta.tool_calls or []:
+                    if tool_call.index not in tool_calls:
+                        # The model has finished the arguments of the calls before this one
+                        start_tool_calls()
+                        tool_calls[tool_call.index] = {
+                            "id": tool_call.id,
+                            "type": "function",
+                            "function": {"name": tool_call.function.name, "arguments": ""}
+                        }
+                    if tool_call.function and tool_call.function.arguments:
+                        tool_calls[tool_call.index]["function"]["arguments"] += tool_call.function.arguments
+            start_tool_calls()
+            results = await asyncio.gather(*[tasks[index] for index in sorted(tasks)])
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        message = {"role": "assistant", "content": "".join(content) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return message, results
+
+    async def get_ai_response(self, prompt):
         """Get a response from OpenAI's API with tool calls"""
         try:
+            await self.compact_history()
+            
             # Add user message to conversation history
             self.conversation_history.append({"role": "user", "content": prompt})
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=self.conversation_history,
-                tools=self.tools,
-                tool_choice="auto"
-            )
-            
-            message = response.choices[0].message
+            request = {
+                "model": "gpt-4o-mini",
+                "messages": self.build_messages(),
+                "tools": self.tools,
+                "tool_choice": "auto"
+            }
+            if LLM_STREAMING:
+                # Tool calls run while the rest of the reply is still being generated
+                message, results = await self.stream_response(**request)
+            else:
+                response = await self.create_completion(**request)
+                message = self.to_history_message(response.choices[0].message)
+                if message.get("tool_calls"):
+                    results = await self.run_tool_calls(message["tool_calls"])
             
             # Add assistant's message to conversation history
             self.conversation_history.append(message)
             
             # Handle tool calls if present
-            if message.tool_calls:
-                tool_calls = message.tool_calls
-                tool_responses = []
+            if message.get("tool_calls"):
+                tool_calls = message["tool_calls"]
                 
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    if function_name == "execute_query":
-                        result = self.execute_query(function_args["query"])
-                    else:
-                        result = json.dumps({"error": f"Unknown function: {function_name}"})
-                    
-                    tool_responses.append({
-                        "tool_call_id": tool_call.id,
-                        "name": function_name,
+                tool_responses = [
+                    {
+                        "tool_call_id": tool_call["id"],
+                        "name": tool_call["function"]["name"],
                         "content": result
-                    })
+                    }
+                    for tool_call, result in zip(tool_calls, results)
+                ]
                 
                 # Add tool responses to conversation history
                 for tr in tool_responses:
@@ -131,83 +589,208 @@ class DatabaseAgent:
                         "content": tr["content"]
                     })
                 
-                # Get final response with tool results
-                final_response = self.client.chat.completions.create(
+                # Small results for plain lookups don't need another round-trip
+                if self.can_answer_directly(prompt, tool_responses):
+                    content = "\n".join(f"```json\n{tr['content']}\n```" for tr in tool_responses)
+                    self.conversation_history.append({"role": "assistant", "content": content})
+                    return content
+                
+                # Get final response with tool results. The tools schema is left out
+                # since the model only has to write the answer now
+                final_response = await self.create_completion(
                     model="gpt-4o-mini",
-                    messages=self.conversation_history
+                    messages=self.build_messages()
                 )
                 
                 # Add final response to conversation history
                 final_message = final_response.choices[0].message
-                self.conversation_history.append(final_message)
+                self.conversation_history.append(self.to_history_message(final_message))
                 
                 return final_message.content
             
-            return message.content
+            return message["content"]
             
         except Exception as e:
             print(f"Error getting AI response: {e}")
             return None
+        finally:
+            self.save_history()
+
+    async def run_batch(self, bodies):
+        """Run chat completion requests through the Batch API and return their messages
+
+        Requests that fail or don't finish within the completion window give None.
+        """
+        lines = [
+            orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            })
+            for i, body in enumerate(bodies)
+        ]
+        batch_file = await self.client.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            batch = await self.client.batches.retrieve(batch.id)
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch.id} failed: {batch.errors}")
+
+        messages = [None] * len(bodies)
+        if batch.output_file_id:
+            output = await self.client.files.content(batch.output_file_id)
+            for line in output.content.splitlines():
+                result = orjson.loads(line)
+                response = result.get("response")
+                if result.get("error") or not response or response["status_code"] != 200:
+                    continue
+                message = response["body"]["choices"][0]["message"]
+                entry = {"role": "assistant", "content": message.get("content")}
+                if message.get("tool_calls"):
+                    entry["tool_calls"] = message["tool_calls"]
+                messages[int(result["custom_id"])] = entry
+        return messages
+
+    async def batch_prompts(self, prompts):
+        """Answer independent prompts through the OpenAI Batch API
+
+        Meant for offline evaluation runs rather than interactive use, since a batch can
+        take up to 24 hours. Each prompt starts a fresh conversation. Tool calls from the
+        first batch are executed locally and the answers come from a second batch. Prompts
+        whose requests failed give None.
+        """
+        conversations = [
+            [{"role": "system", "content": self.SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+            for prompt in prompts
+        ]
+        messages = await self.run_batch([
+            {"model": "gpt-4o-mini", "messages": conversation, "tools": self.tools, "tool_choice": "auto"}
+            for conversation in conversations
+        ])
+
+        answers = [None] * len(prompts)
+        pending = []
+        for i, message in enumerate(messages):
+            if message is None:
+                continue
+            conversations[i].append(message)
+            if message.get("tool_calls"):
+                pending.append(i)
+            else:
+                answers[i] = message["content"]
+        if not pending:
+            return answers
+
+        all_results = await asyncio.gather(
+            *[self.run_tool_calls(conversations[i][-1]["tool_calls"]) for i in pending]
+        )
+        for i, results in zip(pending, all_results):
+            for tool_call, result in zip(conversations[i][-1]["tool_calls"], results):
+                conversations[i].append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "content": result
+                })
+        final_messages = await self.run_batch([
+            {"model": "gpt-4o-mini", "messages": conversations[i]} for i in pending
+        ])
+        for i, message in zip(pending, final_messages):
+            if message is not None:
+                answers[i] = message["content"]
+        return answers
 
     def clear_memory(self):
         """Clear the conversation history"""
         self.conversation_history = [
-            {"role": "system", "content": "You are a helpful database assistant. You can execute SQL queries to explore and analyze the database. Remember previous interactions and use that context to provide more relevant responses."}
+            {"role": "system", "content": self.SYSTEM_PROMPT}
         ]
+        self.summary = None
+        self.save_history()
 
-    def close(self):
-        """Close the database connection"""
-        if self.db_connection:
-            self.db_connection.close()
+    async def close(self):
+        """Close the database connection pool"""
+        if not self.pool.closed:
+            await self.pool.close()
             print("Database connection closed")
 
-def main():
-    print("Welcome to the Database AI Agent!")
-    print("You can ask questions about your database or request operations.")
-    print("Type 'exit' or 'quit' to end the session.")
-    print("Type 'clear' to clear the conversation history.")
-    print("-" * 50)
-    
-    agent = DatabaseAgent()
-    
+def chat_loop(agent, loop):
+    """Read user input and answer until the user exits
+
+    The prompt is read synchronously so Ctrl-C exits right away. Only the agent's
+    calls run on the event loop, which is kept alive between turns.
+    """
+    loop.run_until_complete(agent.connect_to_db())
     try:
         while True:
             try:
                 # Get user input
                 user_input = input("\nYou: ").strip()
-                
+            
                 # Check for exit command
                 if user_input.lower() in ['exit', 'quit']:
                     print("\nGoodbye!")
                     break
-                
+            
                 # Check for clear memory command
                 if user_input.lower() == 'clear':
                     agent.clear_memory()
                     print("\nConversation history cleared.")
                     continue
-                
+            
                 # Skip empty inputs
                 if not user_input:
                     continue
-                
+            
                 # Get AI response
                 print("\nAgent: ", end="")
-                response = agent.get_ai_response(user_input)
+                task = loop.create_task(agent.get_ai_response(user_input))
+                try:
+                    response = loop.run_until_complete(task)
+                except KeyboardInterrupt:
+                    # Let the interrupted turn unwind before the pool is closed
+                    task.cancel()
+                    loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+                    raise
                 if response:
                     print(response)
                 else:
                     print("I apologize, but I encountered an error processing your request.")
-                
+            
             except KeyboardInterrupt:
                 print("\n\nGoodbye!")
                 break
             except Exception as e:
                 print(f"\nAn error occurred: {str(e)}")
                 print("Please try again or type 'exit' to quit.")
+    finally:
+        loop.run_until_complete(agent.close())
+
+def main():
+    print("Welcome to the Database AI Agent!")
+    print("You can ask questions about your database or request operations.")
+    print("Type 'exit' or 'quit' to end the session.")
+    print("Type 'clear' to clear the conversation history.")
+    print("-" * 50)
     
+    # uvloop schedules the many concurrent HTTP and database calls faster
+    loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = DatabaseAgent()
+    
+    try:
+        chat_loop(agent, loop)
+    except KeyboardInterrupt:
+        print("\n\nGoodbye!")
     finally:
-        agent.close()
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file